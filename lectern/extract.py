@@ -1,5 +1,6 @@
 __all__ = [
     "Extractor",
+    "DirectiveRegex",
     "TextExtractor",
     "EmbeddedExtractor",
     "MarkdownExtractor",
@@ -8,19 +9,26 @@ __all__ = [
 ]
 
 
+import os
 import re
-from dataclasses import replace
-from itertools import islice
+import sys
+from contextlib import suppress
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from importlib import import_module
+from itertools import chain, product
 from pathlib import Path
 from typing import (
     Any,
     Callable,
     Dict,
+    FrozenSet,
     Iterable,
     Iterator,
     List,
     Mapping,
     Optional,
+    Sequence,
     Tuple,
     Union,
 )
@@ -36,47 +44,92 @@ from .fragment import Fragment
 
 FragmentLoader = Callable[[Fragment, Mapping[str, Directive]], Optional[Fragment]]
 
+TokenHandler = Callable[
+    [
+        List[Token],
+        int,
+        "re.Pattern[str]",
+        Optional["re.Match[str]"],
+        Optional[FileSystemPath],
+    ],
+    Optional[Fragment],
+]
+
+HTML_COMMENT_REGEX = re.compile(r"\s*<!--\s*(.+?)\s*-->\s*")
+
+
+@dataclass(frozen=True)
+class DirectiveRegex:
+    """Compiled patterns for a specific set of directives."""
+
+    anchored: "re.Pattern[str]"
+    multiline: "re.Pattern[str]"
+    escaped: "re.Pattern[str]"
+
 
 class Extractor:
     """Base class for extractors."""
 
     directives: Dict[str, Directive]
-    regex: Optional["re.Pattern[str]"]
-    escaped_regex: Optional["re.Pattern[str]"]
+    regex_backend: Any
+    regex_cache: Dict[FrozenSet[str], DirectiveRegex]
+    regex_cache_size: int
     cache: Optional[Cache]
 
     def __init__(self, cache: Optional[Cache] = None):
         self.directives = {}
-        self.regex = None
-        self.escaped_regex = None
+        self.regex_backend = load_regex_backend()
+        self.regex_cache = {}
+        self.regex_cache_size = 32
         self.cache = cache
 
+    def generate_names(self) -> str:
+        """Return the alternation of directive names, longest names first."""
+        return "|".join(sorted(self.directives, key=len, reverse=True))
+
     def generate_regex(self) -> str:
         """Return a regex that can match the current directives."""
-        names = "|".join(self.directives)
+        names = self.generate_names()
         modifier = r"(?:\((?P<modifier>[^)]*)\)|\b)"
         arguments = r"(?P<arguments>.*)"
         return f"@(?P<name>{names}){modifier}{arguments}"
 
     def generate_escaped_regex(self) -> str:
         """Return a regex that can match escaped fragments."""
-        names = "|".join(self.directives)
+        names = self.generate_names()
         return fr"(@@+(?:{names})\b.*)"
 
     def compile_regex(self, regex: str) -> "re.Pattern[str]":
-        """Return the compiled pattern for the directive regex."""
-        return re.compile(f"^{regex}$", flags=re.MULTILINE)
+        """Return the compiled pattern for matching the regex on every line."""
+        backend = self.regex_backend
+        return backend.compile(f"^{regex}$", flags=backend.MULTILINE)
 
-    def get_regex(self, directives: Mapping[str, Directive]) -> "re.Pattern[str]":
+    def compile_anchored_regex(self, regex: str) -> "re.Pattern[str]":
+        """Return the compiled pattern for matching the regex on a whole string."""
+        return self.regex_backend.compile(fr"\A{regex}\Z")
+
+    def get_regex(self, directives: Mapping[str, Directive]) -> DirectiveRegex:
         """Create and return the regex for the specified directives."""
-        directives = dict(directives)
+        # Only the directive names end up in the generated patterns.
+        key = frozenset(directives)
+
+        if key in self.regex_cache:
+            directive_regex = self.regex_cache.pop(key)
+        else:
+            self.directives = dict(directives)
+            regex = self.generate_regex()
+            directive_regex = DirectiveRegex(
+                anchored=self.compile_anchored_regex(regex),
+                multiline=self.compile_regex(regex),
+                escaped=self.compile_regex(self.generate_escaped_regex()),
+            )
 
-        if self.regex is None or self.directives != directives:
-            self.directives = directives
-            self.regex = self.compile_regex(self.generate_regex())
-            self.escaped_regex = self.compile_regex(self.generate_escaped_regex())
+        while self.regex_cache and len(self.regex_cache) >= self.regex_cache_size:
+            del self.regex_cache[next(iter(self.regex_cache))]
 
-        return self.regex
+        if self.regex_cache_size > 0:
+            self.regex_cache[key] = directive_regex
+        return directive_regex
 
     def split(
         self,
@@ -115,6 +168,7 @@ class Extractor:
     ) -> Tuple[ResourcePack, DataPack]:
         """Apply directives into a blank data pack and a blank resource pack."""
         assets, data = ResourcePack(), DataPack()
+        loaders = tuple(loaders)
 
         for fragment in fragments:
             for loader in loaders:
@@ -144,11 +198,11 @@ class Extractor:
         path: Optional[FileSystemPath] = None,
     ):
         """Helper for creating a fragment from a matched pattern."""
-        directive, modifier, arguments = match.groups()
+        directive, modifier, arguments = match.group("name", "modifier", "arguments")
         return Fragment(
             start_line=start_line,
             end_line=end_line,
-            directive=directive,
+            directive=sys.intern(directive),
             modifier=modifier,
             arguments=arguments.split(),
             content=content,
@@ -166,32 +220,93 @@ class TextExtractor(Extractor):
         source: str,
         directives: Mapping[str, Directive],
     ) -> Iterator[Fragment]:
-        tokens = self.get_regex(directives).split(source + "\n")
-        assert self.escaped_regex
+        if "@" not in source:
+            return
+
+        regex = self.get_regex(directives)
+        text = source + "\n"
+
+        matches = regex.multiline.finditer(text)
+        if not (match := next(matches, None)):
+            return
+
+        # Fragments are contiguous so only the lines before the first one are counted.
+        start_line = text.count("\n", 0, match.start())
 
-        it = iter(tokens)
-        newlines = next(it).count("\n")
+        for next_match in chain(matches, [None]):
+            position = next_match.start() if next_match else len(text)
 
-        while True:
-            try:
-                directive, modifier, arguments, content = islice(it, 4)
-            except ValueError:
+            # Skip the end of the directive line and the final newline.
+            start = match.end() + 1
+            end_line = start_line + text.count("\n", start, position) + 1
+            content = self.unescape(regex, text[start : max(start, position - 1)])
+
+            yield self.create_fragment(start_line, end_line, match, content)
+
+            if not next_match:
                 return
-            else:
-                content = content.partition("\n")[-1]
-                content = "".join(
-                    s.replace("@@", "@", 1) if i % 2 else s
-                    for i, s in enumerate(self.escaped_regex.split(content))
-                )
-                yield Fragment(
-                    start_line=newlines,
-                    end_line=(newlines := newlines + content.count("\n") + 1),
-                    directive=directive,
-                    modifier=modifier,
-                    arguments=arguments.split(),
-                    content=content[:-1] if content.endswith("\n") else content,
-                    cache=self.cache,
-                )
+            match, start_line = next_match, end_line
+
+    def parse_sources(
+        self,
+        sources: Sequence[str],
+        directives: Mapping[str, Directive],
+    ) -> Iterator[Tuple[int, Fragment]]:
+        """Parse multiple sources in a single pass and yield fragments by index."""
+        for index, start_line, end_line, match, content in self.match_sources(
+            sources, directives
+        ):
+            yield index, self.create_fragment(start_line, end_line, match, content)
+
+    def match_sources(
+        self,
+        sources: Sequence[str],
+        directives: Mapping[str, Directive],
+    ) -> Iterator[Tuple[int, int, int, "re.Match[str]", str]]:
+        """Yield the matched directives with their line range and content by index."""
+        if not any("@" in source for source in sources):
+            return
+
+        regex = self.get_regex(directives)
+
+        # Sources are separated by a line that directives can't span over.
+        separator = "\0\n"
+        text = separator.join(source + "\n" for source in sources)
+
+        matches = list(regex.multiline.finditer(text))
+        next_starts = [match.start() for match in matches[1:]] + [len(text)]
+
+        index = -1
+        position = end = newlines = 0
+
+        for match, next_start in zip(matches, next_starts):
+            while match.start() >= end:
+                # Move on to the source containing the match.
+                index += 1
+                position = end + len(separator) if index else 0
+                end = position + len(sources[index]) + 1
+                newlines = 0
+
+            newlines += text.count("\n", position, match.start())
+            position = min(next_start, end)
+
+            # Skip the end of the directive line and the final newline.
+            start = match.end() + 1
+            end_line = newlines + text.count("\n", start, position) + 1
+            content = self.unescape(regex, text[start : max(start, position - 1)])
+
+            yield index, newlines, end_line, match, content
+            newlines = end_line
+
+    def unescape(self, regex: DirectiveRegex, content: str) -> str:
+        """Remove one level of escaping from the escaped directives in the content."""
+        if "@@" not in content:
+            return content
+        if len(parts := regex.escaped.split(content)) == 1:
+            return content
+        return "".join(
+            [s.replace("@@", "@", 1) if i % 2 else s for i, s in enumerate(parts)]
+        )
 
 
 class EmbeddedExtractor(TextExtractor):
@@ -224,13 +339,101 @@ class MarkdownExtractor(Extractor):
     comment_extractor: TextExtractor
     parser: MarkdownIt
     html_comment_regex: "re.Pattern[str]"
+    token_shapes: Dict[Tuple[str, ...], List[TokenHandler]]
+    shape_sizes: Dict[str, List[int]]
+    token_cache: Dict[str, List[Token]]
+    token_cache_size: int
 
     def __init__(self, cache: Optional[Cache] = None):
         super().__init__(cache)
         self.embedded_extractor = EmbeddedExtractor(cache)
         self.comment_extractor = TextExtractor(cache)
         self.parser = MarkdownParserWithUncheckedLinks()
-        self.html_comment_regex = re.compile(r"\s*<!--\s*(.+?)\s*-->\s*")
+        self.html_comment_regex = HTML_COMMENT_REGEX
+        self.token_shapes = {}
+        self.shape_sizes = {}
+        self.token_cache = {}
+        self.token_cache_size = 32
+
+        # Handlers registered for the same shape are tried in order.
+        self.register_shape(
+            self.parse_code_fragment,
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+            ["fence", "code_block"],
+        )
+        self.register_shape(
+            self.parse_image_fragment,
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+        )
+        self.register_shape(
+            self.parse_details_code_fragment,
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+            "html_block",
+            ["fence", "code_block"],
+            "html_block",
+        )
+        self.register_shape(
+            self.parse_details_image_fragment,
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+            "html_block",
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+            "html_block",
+        )
+        self.register_shape(
+            self.parse_link_fragment,
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+        )
+        self.register_shape(
+            self.parse_comment_code_fragment,
+            "html_block",
+            ["fence", "code_block"],
+        )
+        self.register_shape(
+            self.parse_comment_image_fragment,
+            "html_block",
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+        )
+        self.register_shape(
+            self.parse_inline_fragment,
+            "paragraph_open",
+            "inline",
+            "paragraph_close",
+        )
+        self.register_shape(
+            self.parse_comment_fragment,
+            "html_block",
+        )
+
+    def register_shape(
+        self,
+        handler: TokenHandler,
+        *token_types: Union[List[str], str],
+    ):
+        """Register a handler for the given sequence of token types."""
+        for shape in product(*([t] if isinstance(t, str) else t for t in token_types)):
+            self.token_shapes.setdefault(shape, []).append(handler)
+
+            sizes = self.shape_sizes.setdefault(shape[0], [])
+            if len(shape) not in sizes:
+                sizes.append(len(shape))
+                sizes.sort(reverse=True)
 
     def extract(
         self,
@@ -251,8 +454,22 @@ class MarkdownExtractor(Extractor):
         directives: Mapping[str, Directive],
         external_files: Optional[FileSystemPath] = None,
     ) -> Iterator[Fragment]:
-        tokens = self.parser.parse(source)  # type: ignore
-        regex = self.get_regex(directives)
+        # Directives always appear verbatim in the source.
+        if "@" not in source:
+            return
+
+        tokens = self.parse_tokens(source)
+        types = [token.type for token in tokens]
+        regex = self.get_regex(directives).anchored
+
+        # Compile the nested patterns upfront instead of on the first code block.
+        self.embedded_extractor.get_regex(directives)
+        self.comment_extractor.get_regex(directives)
+
+        # Code blocks are parsed together after the loop, so fragments are buffered
+        # and code blocks leave a placeholder with their index in the list.
+        fragments: List[Union[Fragment, int]] = []
+        code_blocks: List[Tuple[str, int, int, int]] = []
 
         skip_to = 0
 
@@ -264,237 +481,32 @@ class MarkdownExtractor(Extractor):
             if skip_to > current_line:
                 continue
 
-            #
-            # `@directive args...`
-            #
-            # ```
-            # content
-            # ```
-            #
-            if (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 4],
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                        ["fence", "code_block"],
-                    )
-                )
-                and (inline := tokens[i + 1])
-                and inline.children
-                and self.match_tokens(inline.children, "code_inline")
-                and (match := regex.match(inline.children[0].content))
-            ):
-                yield self.create_fragment(
-                    current_line, skip_to, match, content=tokens[i + 3].content
-                )
-
-            #
-            # `@directive args...`
-            #
-            # ![](path/to/image)
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 6],
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                    )
-                )
-                and (inline := tokens[i + 1])
-                and inline.children
-                and self.match_tokens(inline.children, "code_inline")
-                and (image := tokens[i + 4])
-                and image.children
-                and self.match_tokens(image.children, "image")
-                and (link := image.children[0].attrGet("src"))
-                and (match := regex.match(inline.children[0].content))
-            ):
-                yield self.create_link_fragment(
-                    current_line, skip_to, match, link, external_files
-                )
-
-            #
-            # `@directive args...`
-            #
-            # <details>
-            #
-            # ```
-            # content
-            # ```
-            #
-            # </details>
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 6],
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                        "html_block",
-                        ["fence", "code_block"],
-                        "html_block",
-                    )
-                )
-                and (inline := tokens[i + 1])
-                and inline.children
-                and self.match_tokens(inline.children, "code_inline")
-                and tokens[i + 3].content == "<details>\n"
-                and tokens[i + 5].content == "</details>\n"
-                and (match := regex.match(inline.children[0].content))
-            ):
-                yield self.create_fragment(
-                    current_line, skip_to, match, content=tokens[i + 4].content
-                )
-
-            #
-            # `@directive args...`
-            #
-            # <details>
-            #
-            # ![](path/to/image)
-            #
-            # </details>
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 8],
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                        "html_block",
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                        "html_block",
-                    )
-                )
-                and (inline := tokens[i + 1])
-                and inline.children
-                and self.match_tokens(inline.children, "code_inline")
-                and tokens[i + 3].content == "<details>\n"
-                and tokens[i + 7].content == "</details>\n"
-                and (image := tokens[i + 5])
-                and image.children
-                and self.match_tokens(image.children, "image")
-                and (link := image.children[0].attrGet("src"))
-                and (match := regex.match(inline.children[0].content))
-            ):
-                yield self.create_link_fragment(
-                    current_line, skip_to, match, link, external_files
-                )
-
-            #
-            # [`@directive args...`](path/to/content)
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 3],
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                    )
-                )
-                and (inline := tokens[i + 1])
-                and inline.children
-                and self.match_tokens(
-                    inline.children,
-                    "link_open",
-                    "code_inline",
-                    "link_close",
-                )
-                and (link := inline.children[0].attrGet("href"))
-                and (match := regex.match(inline.children[1].content))
-            ):
-                yield self.create_link_fragment(
-                    current_line, skip_to, match, link, external_files
-                )
-
-            #
-            # <!-- @directive args... -->
-            #
-            # ```
-            # content
-            # ```
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 2],
-                        "html_block",
-                        ["fence", "code_block"],
-                    )
-                )
-                and (comment := self.html_comment_regex.match(token.content))
-                and (match := regex.match(comment.group(1)))
-            ):
-                yield self.create_fragment(
-                    current_line, skip_to, match, content=tokens[i + 1].content
-                )
-
-            #
-            # <!-- @directive args... -->
-            #
-            # ![](path/to/image)
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 4],
-                        "html_block",
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                    )
-                )
-                and (comment := self.html_comment_regex.match(token.content))
-                and (image := tokens[i + 2])
-                and image.children
-                and self.match_tokens(image.children, "image")
-                and (link := image.children[0].attrGet("src"))
-                and (match := regex.match(comment.group(1)))
-            ):
-                yield self.create_link_fragment(
-                    current_line, skip_to, match, link, external_files
-                )
-
-            #
-            # `@directive args...`
-            #
-            elif (
-                (
-                    skip_to := self.match_tokens(
-                        tokens[i : i + 3],
-                        "paragraph_open",
-                        "inline",
-                        "paragraph_close",
-                    )
-                )
-                and (inline := tokens[i + 1])
-                and inline.children
-                and self.match_tokens(inline.children, "code_inline")
-                and (match := regex.match(inline.children[0].content))
-            ):
-                yield self.create_fragment(current_line, skip_to, match)
+            fragment = None
+
+            # Match the html comment once for all the shapes starting with it.
+            comment = None
+            if token.type == "html_block":
+                comment = self.html_comment_regex.match(token.content)
+
+            # Only probe the shapes that can start with the current token and that
+            # fit in the remaining tokens.
+            if sizes := self.shape_sizes.get(token.type):
+                remaining = len(tokens) - i
+                shape = tuple(types[i : i + sizes[0]])
+                for size in sizes:
+                    if size > remaining:
+                        continue
+                    for handler in self.token_shapes.get(shape[:size], ()):
+                        if fragment := handler(
+                            tokens, i, regex, comment, external_files
+                        ):
+                            break
+                    if fragment:
+                        break
 
-            #
-            # <!-- @directive args... -->
-            #
-            elif (
-                token.type == "html_block"
-                and (comment := self.html_comment_regex.match(token.content))
-                and (match := regex.match(comment.group(1)))
-            ):
-                yield self.create_fragment(current_line, skip_to, match)
+            if fragment:
+                skip_to = fragment.end_line
+                fragments.append(fragment)
 
             #
             # ```
@@ -504,16 +516,11 @@ class MarkdownExtractor(Extractor):
             # ```
             #
             elif token.type in ["fence", "code_block"]:
+                fragments.append(len(code_blocks))
                 offset = int(token.type == "fence")
-                for fragment in self.embedded_extractor.parse_fragments(
-                    token.content,
-                    directives,
-                ):
-                    yield replace(
-                        fragment,
-                        start_line=fragment.start_line + current_line + offset,
-                        end_line=(skip_to := fragment.end_line + current_line),
-                    )
+                code_blocks.append(
+                    (token.content, current_line + offset, current_line, token.map[-1])
+                )
 
             #
             # <!--
@@ -528,35 +535,352 @@ class MarkdownExtractor(Extractor):
                 and html.startswith("<!--")
                 and html.endswith("-->")
             ):
-                for fragment in self.comment_extractor.parse_fragments(
-                    html[4:-3],
-                    directives,
+                comment_source = (html[4:-3], current_line, current_line, token.map[-1])
+                for _, fragment in self.parse_nested_fragments(
+                    self.comment_extractor, [comment_source], directives
                 ):
-                    yield replace(
+                    skip_to = fragment.end_line
+                    fragments.append(fragment)
+
+        embedded: Dict[int, List[Fragment]] = {}
+        for index, fragment in self.parse_nested_fragments(
+            self.embedded_extractor, code_blocks, directives
+        ):
+            embedded.setdefault(index, []).append(fragment)
+
+        for fragment in fragments:
+            if isinstance(fragment, Fragment):
+                yield fragment
+            else:
+                yield from embedded.get(fragment, ())
+
+    def parse_nested_fragments(
+        self,
+        extractor: TextExtractor,
+        sources: Sequence[Tuple[str, int, int, int]],
+        directives: Mapping[str, Directive],
+    ) -> Iterator[Tuple[int, Fragment]]:
+        """Parse the nested sources and yield fragments with their final lines by index.
+
+        Each source comes with the offsets of the start and end lines of its fragments
+        and with the line that its fragments can't go past.
+        """
+        # Extractors overriding parse_fragments get each source individually.
+        if type(extractor).parse_fragments is not TextExtractor.parse_fragments:
+            for index, (source, start_offset, end_offset, last_line) in enumerate(
+                sources
+            ):
+                for fragment in extractor.parse_fragments(source, directives):
+                    yield index, replace(
                         fragment,
-                        start_line=fragment.start_line + current_line,
-                        end_line=(skip_to := fragment.end_line + current_line),
+                        start_line=fragment.start_line + start_offset,
+                        end_line=min(fragment.end_line + end_offset, last_line),
                     )
+            return
+
+        # Otherwise all the sources are matched in a single pass and the fragments are
+        # created directly with their final lines.
+        matches = extractor.match_sources(
+            [source for source, *_ in sources], directives
+        )
+        for index, start_line, end_line, match, content in matches:
+            _, start_offset, end_offset, last_line = sources[index]
+            # Indented code blocks don't have a closing fence to absorb the final
+            # newline, so the last fragment must not spill over the next token.
+            yield index, extractor.create_fragment(
+                start_line + start_offset,
+                min(end_line + end_offset, last_line),
+                match,
+                content,
+            )
+
+    def parse_tokens(self, source: str) -> List[Token]:
+        """Parse the markdown source and keep the tokens of recent sources around."""
+        if source in self.token_cache:
+            tokens = self.token_cache.pop(source)
+        else:
+            tokens = self.parser.parse(source)  # type: ignore
+
+        while self.token_cache and len(self.token_cache) >= self.token_cache_size:
+            del self.token_cache[next(iter(self.token_cache))]
+
+        if self.token_cache_size > 0:
+            self.token_cache[source] = tokens
+        return tokens
+
+    def parse_code_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse a code block annotated with an inline directive.
+
+        `@directive args...`
+
+        ```
+        content
+        ```
+        """
+        if match := self.match_inline_directive(tokens[index + 1], regex):
+            code = tokens[index + 3]
+            start_line, end_line = self.get_line_range(tokens[index], code)
+            return self.create_fragment(
+                start_line, end_line, match, content=code.content
+            )
+
+    def parse_image_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse an image annotated with an inline directive.
+
+        `@directive args...`
+
+        ![](path/to/image)
+        """
+        if (
+            (match := self.match_inline_directive(tokens[index + 1], regex))
+            and (image := tokens[index + 4])
+            and (link := self.get_image_link(image))
+        ):
+            start_line, end_line = self.get_line_range(tokens[index], image)
+            return self.create_link_fragment(
+                start_line, end_line, match, link, external_files
+            )
+
+    def parse_details_code_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse a folded code block annotated with an inline directive.
+
+        `@directive args...`
+
+        <details>
+
+        ```
+        content
+        ```
+
+        </details>
+        """
+        if (
+            tokens[index + 3].content == "<details>\n"
+            and tokens[index + 5].content == "</details>\n"
+            and (match := self.match_inline_directive(tokens[index + 1], regex))
+        ):
+            start_line, end_line = self.get_line_range(tokens[index], tokens[index + 5])
+            return self.create_fragment(
+                start_line, end_line, match, content=tokens[index + 4].content
+            )
+
+    def parse_details_image_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse a folded image annotated with an inline directive.
+
+        `@directive args...`
+
+        <details>
+
+        ![](path/to/image)
+
+        </details>
+        """
+        if (
+            tokens[index + 3].content == "<details>\n"
+            and tokens[index + 7].content == "</details>\n"
+            and (link := self.get_image_link(tokens[index + 5]))
+            and (match := self.match_inline_directive(tokens[index + 1], regex))
+        ):
+            start_line, end_line = self.get_line_range(tokens[index], tokens[index + 7])
+            return self.create_link_fragment(
+                start_line, end_line, match, link, external_files
+            )
+
+    def parse_link_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse an inline directive wrapped in a link.
+
+        [`@directive args...`](path/to/content)
+        """
+        if (
+            (inline := tokens[index + 1])
+            and inline.children
+            and len(inline.children) == 3
+            and self.match_tokens(
+                inline.children,
+                0,
+                "link_open",
+                "code_inline",
+                "link_close",
+            )
+            and (link := inline.children[0].attrs.get("href"))
+            and (match := regex.match(inline.children[1].content))
+        ):
+            start_line, end_line = self.get_line_range(tokens[index], inline)
+            return self.create_link_fragment(
+                start_line, end_line, match, link, external_files
+            )
+
+    def parse_comment_code_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse a code block annotated with a comment directive.
+
+        <!-- @directive args... -->
+
+        ```
+        content
+        ```
+        """
+        if match := self.match_comment_directive(comment, regex):
+            code = tokens[index + 1]
+            start_line, end_line = self.get_line_range(tokens[index], code)
+            return self.create_fragment(
+                start_line, end_line, match, content=code.content
+            )
+
+    def parse_comment_image_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse an image annotated with a comment directive.
+
+        <!-- @directive args... -->
+
+        ![](path/to/image)
+        """
+        if (
+            (match := self.match_comment_directive(comment, regex))
+            and (image := tokens[index + 2])
+            and (link := self.get_image_link(image))
+        ):
+            start_line, end_line = self.get_line_range(tokens[index], image)
+            return self.create_link_fragment(
+                start_line, end_line, match, link, external_files
+            )
+
+    def parse_inline_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse an inline directive without content.
+
+        `@directive args...`
+        """
+        if match := self.match_inline_directive(inline := tokens[index + 1], regex):
+            start_line, end_line = self.get_line_range(tokens[index], inline)
+            return self.create_fragment(start_line, end_line, match)
+
+    def parse_comment_fragment(
+        self,
+        tokens: List[Token],
+        index: int,
+        regex: "re.Pattern[str]",
+        comment: Optional["re.Match[str]"] = None,
+        external_files: Optional[FileSystemPath] = None,
+    ) -> Optional[Fragment]:
+        """Parse a comment directive without content.
+
+        <!-- @directive args... -->
+        """
+        if match := self.match_comment_directive(comment, regex):
+            start_line, end_line = self.get_line_range(tokens[index], tokens[index])
+            return self.create_fragment(start_line, end_line, match)
+
+    def match_inline_directive(
+        self,
+        inline: Token,
+        regex: "re.Pattern[str]",
+    ) -> Optional["re.Match[str]"]:
+        """Match the directive in an inline token containing only inline code."""
+        if (
+            inline.children
+            and len(inline.children) == 1
+            and self.match_tokens(inline.children, 0, "code_inline")
+        ):
+            return regex.match(inline.children[0].content)
+        return None
+
+    def match_comment_directive(
+        self,
+        comment: Optional["re.Match[str]"],
+        regex: "re.Pattern[str]",
+    ) -> Optional["re.Match[str]"]:
+        """Match the directive in the html comment matched for the current token."""
+        if comment:
+            return regex.match(comment.group(1))
+        return None
+
+    def get_line_range(self, first: Token, last: Token) -> Tuple[int, int]:
+        """Return the lines spanned by the tokens between first and last."""
+        return (first.map[0] if first.map else 0, last.map[-1] if last.map else 0)
+
+    def get_image_link(self, inline: Token) -> Any:
+        """Return the source of an inline token containing only an image."""
+        if (
+            inline.children
+            and len(inline.children) == 1
+            and self.match_tokens(inline.children, 0, "image")
+        ):
+            return inline.children[0].attrs.get("src")
+        return None
 
     def match_tokens(
         self,
-        tokens: Optional[List[Token]],
+        tokens: Sequence[Token],
+        start: int,
         *token_types: Union[List[str], str],
     ) -> int:
-        """Return whether the list of tokens matches the provided token types."""
-        return (
-            tokens is not None
-            and len(tokens) == len(token_types)
-            and all(
-                (
-                    token_type == token.type
-                    if isinstance(token_type, str)
-                    else token.type in token_type
-                )
-                for token, token_type in zip(tokens, token_types)
-            )
-            and next((token.map[-1] for token in reversed(tokens) if token.map), 1)
-        )
+        """Return the number of tokens matching the provided token types at start."""
+        if start + len(token_types) > len(tokens):
+            return 0
+
+        for offset, token_type in enumerate(token_types):
+            current_type = tokens[start + offset].type
+            if isinstance(token_type, str):
+                if current_type != token_type:
+                    return 0
+            elif current_type not in token_type:
+                return 0
+
+        return len(token_types)
 
     def create_link_fragment(
         self,
@@ -570,9 +894,27 @@ class MarkdownExtractor(Extractor):
         url = str(link)
         path = None
 
-        if urlparse(url).path == url:
+        if is_local_link(url):
             if external_files:
                 path = Path(external_files, url).resolve()
             url = None
 
         return self.create_fragment(start_line, end_line, match, url=url, path=path)
+
+
+def load_regex_backend() -> Any:
+    """Return the module used for compiling directive patterns.
+
+    Setting the LECTERN_REGEX_BACKEND environment variable to "regex" opts into the
+    third-party regex module when it's installed.
+    """
+    if os.environ.get("LECTERN_REGEX_BACKEND") == "regex":
+        with suppress(ImportError):
+            return import_module("regex")
+    return re
+
+
+@lru_cache(maxsize=1024)
+def is_local_link(link: str) -> bool:
+    """Return whether the markdown link refers to a local path instead of a url."""
+    return urlparse(link).path == link
@@ -1,29 +1,184 @@
+from pathlib import Path
+from typing import Iterator, List, Mapping
+
 import pytest
 
-from lectern import Fragment, TextExtractor, get_builtin_directives
+from lectern import (
+    Directive,
+    EmbeddedExtractor,
+    Fragment,
+    MarkdownExtractor,
+    TextExtractor,
+    get_builtin_directives,
+)
 
 
 @pytest.mark.parametrize(
-    "source,  fragment",
+    "extractor, source,  fragment",
     [
         (
+            TextExtractor(),
             "@function demo:foo\nsay foo\n",
             Fragment(0, 3, "function", None, ["demo:foo"], "say foo\n"),
         ),
         (
+            TextExtractor(),
             "@function() demo:foo\nsay foo\n",
             Fragment(0, 3, "function", "", ["demo:foo"], "say foo\n"),
         ),
         (
+            TextExtractor(),
             "@function(strip_final_newline) demo:foo\nsay foo\n",
             Fragment(
                 0, 3, "function", "strip_final_newline", ["demo:foo"], "say foo\n"
             ),
         ),
+        (
+            EmbeddedExtractor(),
+            "# @function demo:foo\nsay foo\n#\n@@function demo:bar\nsay bar\n",
+            Fragment(
+                0,
+                6,
+                "function",
+                None,
+                ["demo:foo"],
+                "say foo\n@function demo:bar\nsay bar\n",
+            ),
+        ),
     ],
 )
-def test_parse(source: str, fragment: Fragment):
-    parsed_fragment = next(
-        TextExtractor().parse_fragments(source, get_builtin_directives())
-    )
+def test_parse(extractor: TextExtractor, source: str, fragment: Fragment):
+    parsed_fragment = next(extractor.parse_fragments(source, get_builtin_directives()))
     assert fragment == parsed_fragment
+
+
+def test_regex_cache():
+    extractor = TextExtractor()
+    directives = get_builtin_directives()
+    regex = extractor.get_regex(directives)
+    assert extractor.get_regex(get_builtin_directives()) is regex
+    assert extractor.get_regex({"function": directives["function"]}) is not regex
+    assert extractor.get_regex(directives) is regex
+
+    extractor.regex_cache_size = 2
+    extractor.get_regex({"skip": directives["skip"]})
+    assert len(extractor.regex_cache) == 2
+    assert extractor.get_regex(directives) is regex
+
+    extractor.regex_cache_size = 0
+    assert extractor.get_regex(directives) is regex
+    assert not extractor.regex_cache
+    assert extractor.get_regex(directives) is not regex
+    assert list(extractor.parse_fragments("@function demo:foo\n", directives))
+
+
+def test_extract_loaders_iterator():
+    seen: List[str] = []
+
+    def loader(fragment: Fragment, directives: Mapping[str, Directive]):
+        seen.append(fragment.directive)
+        return fragment
+
+    _, data = TextExtractor().extract(
+        "@function demo:foo\nsay foo\n@function demo:bar\nsay bar\n",
+        get_builtin_directives(),
+        iter([loader]),
+    )
+    assert seen == ["function", "function"]
+    assert len(data.functions) == 2
+
+
+def test_parse_sources():
+    sources = ["# @function demo:foo\nsay foo\n#", "say nothing", "@function demo:bar"]
+    fragments = list(
+        EmbeddedExtractor().parse_sources(sources, get_builtin_directives())
+    )
+    assert fragments == [
+        (0, Fragment(0, 3, "function", None, ["demo:foo"], "say foo\n#"))
+    ]
+
+
+def test_regex_backend(monkeypatch: pytest.MonkeyPatch):
+    regex = pytest.importorskip("regex")
+    default_extractor = EmbeddedExtractor()
+    monkeypatch.setenv("LECTERN_REGEX_BACKEND", "regex")
+
+    extractor = EmbeddedExtractor()
+    assert default_extractor.regex_backend is not regex
+    assert extractor.regex_backend is regex
+
+    source = "# @function demo:foo\nsay foo\n# @@function escaped\n"
+    directives = get_builtin_directives()
+    assert list(extractor.parse_fragments(source, directives)) == list(
+        default_extractor.parse_fragments(source, directives)
+    )
+
+
+def test_link_relative_to_working_directory(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    extractor = MarkdownExtractor()
+    directives = get_builtin_directives()
+    source = "`@texture demo:foo`\n\n![](img.png)\n"
+
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        monkeypatch.chdir(tmp_path / name)
+        fragment = next(extractor.parse_fragments(source, directives, "docs"))
+        assert fragment.path == tmp_path / name / "docs" / "img.png"
+
+
+def test_markdown_token_cache():
+    extractor = MarkdownExtractor()
+    extractor.token_cache_size = 2
+    directives = get_builtin_directives()
+
+    source = "`@function demo:foo`\n\n```\nsay foo\n```\n"
+    fragments = list(extractor.parse_fragments(source, directives))
+    tokens = extractor.token_cache[source]
+
+    assert list(extractor.parse_fragments(source, directives)) == fragments
+    assert extractor.parse_tokens(source) is tokens
+
+    extractor.parse_tokens("a")
+    extractor.parse_tokens(source)
+    extractor.parse_tokens("b")
+    assert list(extractor.token_cache) == [source, "b"]
+
+    extractor.token_cache_size = 0
+    assert list(extractor.parse_fragments(source, directives)) == fragments
+    assert not extractor.token_cache
+
+
+def test_no_directive_character():
+    extractor = MarkdownExtractor()
+    directives = get_builtin_directives()
+    source = "# Title\n\n`function demo:foo`\n\n```\nsay foo\n```\n"
+    assert list(extractor.parse_fragments(source, directives)) == []
+    assert not extractor.token_cache
+    assert list(TextExtractor().parse_sources(["say foo", ""], directives)) == []
+
+
+def test_nested_parse_fragments_override():
+    class IgnoringExtractor(EmbeddedExtractor):
+        def parse_fragments(
+            self,
+            source: str,
+            directives: Mapping[str, Directive],
+        ) -> Iterator[Fragment]:
+            for fragment in super().parse_fragments(source, directives):
+                if fragment.modifier != "ignore":
+                    yield fragment
+
+    extractor = MarkdownExtractor()
+    extractor.embedded_extractor = IgnoringExtractor()
+    source = (
+        "```\n"
+        "# @function(ignore) demo:foo\n"
+        "say foo\n"
+        "# @function demo:bar\n"
+        "say bar\n"
+        "```\n"
+    )
+    fragments = list(extractor.parse_fragments(source, get_builtin_directives()))
+    assert fragments == [Fragment(3, 5, "function", None, ["demo:bar"], "say bar\n")]
@@ -3,7 +3,14 @@ from typing import Mapping, Optional
 import pytest
 from beet import DataPack, Function, ResourcePack
 
-from lectern import Directive, Document, Fragment, InvalidFragment
+from lectern import (
+    Directive,
+    Document,
+    Fragment,
+    InvalidFragment,
+    MarkdownExtractor,
+    get_builtin_directives,
+)
 
 
 def test_empty():
@@ -96,3 +103,42 @@ def test_loader():
     document.loaders.append(handle_ignore_modifier)
     document.add_text("@function(ignore) demo:foo\nsay hello")
     assert not document.data
+
+
+def test_markdown_after_indented_code():
+    source = (
+        "    # @function demo:foo\n"
+        "    say foo\n"
+        "`@function demo:bar`\n"
+        "\n"
+        "```\n"
+        "say bar\n"
+        "```\n"
+    )
+    doc = Document(markdown=source)
+    assert set(doc.data.functions) == {"demo:foo", "demo:bar"}
+
+    extractor = MarkdownExtractor()
+    directives = get_builtin_directives()
+    fragments = extractor.parse_fragments(source, directives)
+    assert [(f.start_line, f.end_line) for f in fragments] == [(0, 2), (2, 7)]
+    assert "".join(text for text, _ in extractor.split(source, directives)) == source
+
+
+def test_markdown_bare_comment_directive():
+    source = (
+        "Text\n"
+        "\n"
+        "<!-- @skip -->\n"
+        "\n"
+        "`@function demo:foo`\n"
+        "\n"
+        "```\n"
+        "say foo\n"
+        "```\n"
+    )
+    extractor = MarkdownExtractor()
+    directives = get_builtin_directives()
+    fragments = extractor.parse_fragments(source, directives)
+    assert [(f.start_line, f.end_line) for f in fragments] == [(2, 3), (4, 9)]
+    assert "".join(text for text, _ in extractor.split(source, directives)) == source